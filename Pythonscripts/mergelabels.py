@@ -5,8 +5,9 @@ import nibabel as nib
 import numpy as np
 from tqdm import tqdm
 import argparse
+from resample_peaks import HCP_SPACING, resample_label_image
 
-def merge_OR_labels(patient_folder, output_folder, binary=False):
+def merge_OR_labels(patient_folder, output_folder, binary=False, target_spacing=None, reference=None):
     os.makedirs(output_folder, exist_ok=True)
     pid = os.path.basename(patient_folder)
     tracts = os.path.join(patient_folder, "tracts")
@@ -28,8 +29,12 @@ def merge_OR_labels(patient_folder, output_folder, binary=False):
         merged[left_data > 0] = 1
         merged[right_data > 0] = 2
 
+    merged_img = nib.Nifti1Image(merged, left_img.affine, left_img.header)
+    if reference is not None or target_spacing is not None:
+        merged_img = resample_label_image(merged_img, target_spacing or HCP_SPACING, reference)
+
     temp_path = os.path.join(output_folder, f"{pid}.nii.gz")
-    nib.save(nib.Nifti1Image(merged, left_img.affine, left_img.header), temp_path)
+    nib.save(merged_img, temp_path)
     return True, [], temp_path
 
 
@@ -38,6 +43,10 @@ if __name__ == "__main__":
     parser.add_argument("--parent_folder", required=True)
     parser.add_argument("--output_folder", required=True)
     parser.add_argument("--mapping_file", required=True)
+    parser.add_argument("--target_spacing", type=float, nargs=3, default=None,
+                        help="Resample labels to this spacing (must match splitpeaks.py --target_spacing)")
+    parser.add_argument("--reference", default=None,
+                        help="Resample labels onto this image's grid (must match splitpeaks.py --reference)")
     args = parser.parse_args()
 
     # Load mapping
@@ -55,9 +64,11 @@ if __name__ == "__main__":
         if os.path.isdir(os.path.join(args.parent_folder, p))
     ]
 
+    reference = nib.load(args.reference) if args.reference else None
     skipped = {}
     for p in tqdm(patients, desc="Merging OR labels", unit="patient"):
-        success, missing, temp = merge_OR_labels(p, args.output_folder, binary=False)
+        success, missing, temp = merge_OR_labels(p, args.output_folder, binary=False, target_spacing=args.target_spacing,
+                                                reference=reference)
         pid = os.path.basename(p)
         if not success:
             skipped[pid] = missing
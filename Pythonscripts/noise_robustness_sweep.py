@@ -0,0 +1,146 @@
+# noise_robustness_sweep.py
+
+import os
+import csv
+import argparse
+import numpy as np
+import torch
+from tqdm import tqdm
+from nnunetv2.inference.export_prediction import convert_predicted_logits_to_segmentation_with_correct_shape
+from predict_imagesTs import (DATASET_NAME, load_test_cases, model_folder_for, set_thread_budget,
+                              build_predictor, preprocess_case)
+
+# ==== Trainers of the noise sweep (see launch_noise_sweep.sh) ====
+TRAINERS = [
+    "nnUNetTrainerPeaksDA_UL1", "nnUNetTrainerPeaksDA_UL2", "nnUNetTrainerPeaksDA_UL3", "nnUNetTrainerPeaksDA_UL4",
+    "nnUNetTrainerPeaksDA_L1", "nnUNetTrainerPeaksDA_L2", "nnUNetTrainerPeaksDA_L3", "nnUNetTrainerPeaksDA_L4",
+    "nnUNetTrainerPeaksDA_L5", "nnUNetTrainerPeaksDA_M1", "nnUNetTrainerPeaksDA_M2",
+    "nnUNetTrainerPeaksDA_H1", "nnUNetTrainerPeaksDA_H2",
+]
+# Gaussian noise variances added to the test peaks
+NOISE_VARIANCES = [0.0, 0.001, 0.005, 0.01, 0.05, 0.1]
+
+
+def load_test_set(predictor, cases, labels_folder, mmap_folder=None):
+    """Preprocess every test case once and read its reference label.
+
+    Returns [(case_id, data (C, X, Y, Z) float32, properties, label)]. With mmap_folder the
+    preprocessed arrays are saved once and memory-mapped instead of kept in RAM.
+    """
+    rw = predictor.plans_manager.image_reader_writer_class()
+    test_set = []
+    for case_id, files in tqdm(cases, desc="Loading test cases", unit="case"):
+        data, properties = preprocess_case(predictor, files)
+        data = data.numpy()
+        if mmap_folder is not None:
+            os.makedirs(mmap_folder, exist_ok=True)
+            npy_file = os.path.join(mmap_folder, f"{case_id}.npy")
+            np.save(npy_file, data)
+            data = np.load(npy_file, mmap_mode="r")
+        label, _ = rw.read_seg(os.path.join(labels_folder, f"{case_id}{predictor.dataset_json['file_ending']}"))
+        test_set.append((case_id, data, properties, label[0]))
+    return test_set
+
+
+def add_peak_noise(data, variance, seed):
+    """Same additive Gaussian noise the PeaksDA trainers use, applied to the preprocessed peaks.
+
+    The seed only depends on (case, level), so every trainer sees identical noisy inputs.
+    """
+    data = np.array(data, dtype=np.float32)  # copy, the cached case stays clean
+    if variance > 0:
+        rng = np.random.default_rng(seed)
+        data += rng.normal(0.0, np.sqrt(variance), size=data.shape).astype(np.float32)
+    return data
+
+
+def dice_per_label(prediction, reference, labels):
+    dice = {}
+    for lbl in labels:
+        pred, ref = prediction == lbl, reference == lbl
+        denom = pred.sum() + ref.sum()
+        dice[lbl] = 2 * np.logical_and(pred, ref).sum() / denom if denom > 0 else np.nan
+    return dice
+
+
+def evaluate_trainer(predictor, test_set, noise_variances, seed=0):
+    """Predict every cached case at every noise level. Returns rows for the long-format CSV."""
+    labels = predictor.label_manager.foreground_labels
+    rows = []
+    for case_idx, (case_id, data, properties, label) in enumerate(test_set):
+        for level_idx, variance in enumerate(noise_variances):
+            noisy = torch.from_numpy(add_peak_noise(data, variance, [seed, case_idx, level_idx]))
+            logits = predictor.predict_logits_from_preprocessed_data(noisy).cpu()
+            segmentation = convert_predicted_logits_to_segmentation_with_correct_shape(
+                logits, predictor.plans_manager, predictor.configuration_manager, predictor.label_manager, properties,
+                num_threads_torch=torch.get_num_threads())
+            for lbl, dice in dice_per_label(segmentation, label, labels).items():
+                rows.append({"case": case_id, "noise_variance": variance, "label": lbl, "dice": dice})
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trainer x test-noise robustness matrix on imagesTs/labelsTs (no noisy copies on disk)")
+    parser.add_argument("--dataset", default=DATASET_NAME)
+    parser.add_argument("--trainers", nargs="+", default=TRAINERS)
+    parser.add_argument("--noise_variances", type=float, nargs="+", default=NOISE_VARIANCES)
+    parser.add_argument("--folds", type=int, nargs="+", default=[2])
+    parser.add_argument("--checkpoint", default="checkpoint_final.pth")
+    parser.add_argument("--output_folder", required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--device", default="cuda", choices=["cuda", "cpu"])
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="CPU thread budget for torch")
+    parser.add_argument("--mmap_folder", default=None, help="Memory-map the preprocessed test cases from here instead of keeping them in RAM")
+    parser.add_argument("--no_mirroring", action="store_true")
+    args = parser.parse_args()
+
+    set_thread_budget(args.threads, 0, 0)
+    os.makedirs(args.output_folder, exist_ok=True)
+    raw_dataset_dir = os.path.join(os.environ["nnUNet_raw"], args.dataset)
+    cases = load_test_cases(raw_dataset_dir)
+    labels_folder = os.path.join(raw_dataset_dir, "labelsTs")
+
+    test_set = None
+    data_identifier = None
+    matrix = {}
+    long_csv = os.path.join(args.output_folder, "noise_robustness_per_case.csv")
+    with open(long_csv, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["trainer", "case", "noise_variance", "label", "dice"])
+        writer.writeheader()
+
+        for trainer in args.trainers:
+            model_folder = model_folder_for(trainer, args.dataset)
+            if not os.path.isdir(model_folder):
+                print(f"⚠️ Skipping {trainer}: {model_folder} not found")
+                continue
+            predictor = build_predictor(model_folder, args.folds, args.checkpoint, args.device, not args.no_mirroring)
+
+            # all trainers share the same plans, so the test set is preprocessed only once
+            if test_set is None:
+                data_identifier = predictor.configuration_manager.data_identifier
+                test_set = load_test_set(predictor, cases, labels_folder, args.mmap_folder)
+                print(f"📋 Cached {len(test_set)} preprocessed test cases ({data_identifier})")
+            elif predictor.configuration_manager.data_identifier != data_identifier:
+                raise ValueError(f"{trainer} uses {predictor.configuration_manager.data_identifier}, "
+                                 f"cached test set was preprocessed for {data_identifier}")
+
+            rows = evaluate_trainer(predictor, test_set, args.noise_variances, args.seed)
+            for row in rows:
+                writer.writerow({"trainer": trainer, **row})
+            f.flush()
+
+            matrix[trainer] = {
+                v: np.nanmean([r["dice"] for r in rows if r["noise_variance"] == v]) for v in args.noise_variances
+            }
+            print(f"✅ {trainer}: " + "  ".join(f"{v:g}: {d:.4f}" for v, d in matrix[trainer].items()))
+
+    # ==== Trainer x test-noise matrix (mean foreground Dice over cases) ====
+    matrix_csv = os.path.join(args.output_folder, "noise_robustness_matrix.csv")
+    with open(matrix_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["trainer"] + [f"var_{v:g}" for v in args.noise_variances])
+        for trainer, dices in matrix.items():
+            writer.writerow([trainer] + [f"{d:.4f}" for d in dices.values()])
+
+    print(f"\n🎉 Robustness matrix written to {matrix_csv}")
+    print(f"📊 Per-case Dice written to {long_csv}")
@@ -0,0 +1,165 @@
+# packed_store.py
+
+import os
+import glob
+import argparse
+import numpy as np
+import nibabel as nib
+import blosc2
+from tqdm import tqdm
+
+# ==== Defaults ====
+# nnU-Net 3d_fullres patch size for Dataset001 (see nnUNetPlans.json)
+PATCH_SIZE = (112, 144, 112)
+STORE_ENDING = ".b2nd"
+
+
+def default_chunks(patch_size):
+    """Spatial chunk shape aligned to the patch size (half a patch per axis).
+
+    A random patch then overlaps at most 3 chunks per axis instead of the whole volume.
+    """
+    return tuple(max(1, int(p) // 2) for p in patch_size)
+
+
+def find_case_channels(images_folder, case_id):
+    """Return sorted channel files {case}_XXXX.nii.gz for one case."""
+    return sorted(glob.glob(os.path.join(images_folder, f"{case_id}_[0-9][0-9][0-9][0-9].nii.gz")))
+
+
+def pack_case(channel_files, label_file, output_file, chunks=None, clevel=5):
+    """Pack all channels (+ label) of one case into a single chunked blosc2 container.
+
+    Layout: float32 array of shape (C + 1, X, Y, Z) where the last channel is the label
+    (or all zeros when no label is given). Chunks span all channels so one patch read
+    returns images and label together. Affine and NIfTI header go into vlmeta.
+    """
+    ref_img = nib.load(channel_files[0])
+    spatial_shape = ref_img.shape[:3]
+    n_channels = len(channel_files)
+
+    data = np.zeros((n_channels + 1, *spatial_shape), dtype=np.float32)
+    for t, f in enumerate(channel_files):
+        img = nib.load(f)
+        if img.shape[:3] != spatial_shape:
+            raise ValueError(f"Shape mismatch in {f}: {img.shape} vs {spatial_shape}")
+        data[t] = img.get_fdata(dtype=np.float32)
+    if label_file is not None:
+        data[-1] = np.asanyarray(nib.load(label_file).dataobj)
+
+    if chunks is None:
+        chunks = default_chunks(PATCH_SIZE)
+    chunks = (n_channels + 1, *[min(c, s) for c, s in zip(chunks, spatial_shape)])
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    arr = blosc2.asarray(
+        data,
+        urlpath=output_file,
+        mode="w",
+        chunks=chunks,
+        cparams=blosc2.CParams(codec=blosc2.Codec.ZSTD, clevel=clevel,
+                               filters=[blosc2.Filter.SHUFFLE]),
+    )
+    arr.vlmeta["n_channels"] = n_channels
+    arr.vlmeta["has_label"] = label_file is not None
+    arr.vlmeta["affine"] = ref_img.affine.tolist()
+    arr.vlmeta["header"] = ref_img.header.binaryblock
+    return arr
+
+
+def open_case(store_file):
+    """Open a packed case read-only. Slicing it only decompresses the chunks that are hit."""
+    return blosc2.open(store_file, mode="r")
+
+
+def read_patch(store, bbox, with_label=True):
+    """Read one patch.
+
+    bbox: [[x0, x1], [y0, y1], [z0, z1]]
+    Returns (images (C, *patch), label (*patch) or None).
+    """
+    if isinstance(store, str):
+        store = open_case(store)
+    n_channels = store.vlmeta["n_channels"]
+    spatial = tuple(slice(lo, hi) for lo, hi in bbox)
+    if with_label and store.vlmeta["has_label"]:
+        patch = store[(slice(None), *spatial)]
+        return patch[:n_channels], patch[n_channels].astype(np.uint8)
+    return store[(slice(0, n_channels), *spatial)], None
+
+
+def _nifti_header(store):
+    return nib.Nifti1Header(binaryblock=store.vlmeta["header"])
+
+
+def channel_as_nifti(store, t):
+    """In-memory NIfTI view of channel t (for tools that still want per-file input)."""
+    if isinstance(store, str):
+        store = open_case(store)
+    affine = np.array(store.vlmeta["affine"])
+    header = _nifti_header(store)
+    header.set_data_dtype(np.float32)
+    return nib.Nifti1Image(store[t], affine, header)
+
+
+def label_as_nifti(store):
+    """In-memory NIfTI view of the label, or None if the case was packed without one."""
+    if isinstance(store, str):
+        store = open_case(store)
+    if not store.vlmeta["has_label"]:
+        return None
+    affine = np.array(store.vlmeta["affine"])
+    header = _nifti_header(store)
+    header.set_data_dtype(np.uint8)
+    label = store[store.vlmeta["n_channels"]].astype(np.uint8)
+    return nib.Nifti1Image(label, affine, header)
+
+
+def export_case_to_nifti(store_file, images_folder, labels_folder=None):
+    """Write {case}_000{t}.nii.gz (+ {case}.nii.gz label) back out, same naming as splitpeaks.py."""
+    case_id = os.path.basename(store_file)[:-len(STORE_ENDING)]
+    store = open_case(store_file)
+    os.makedirs(images_folder, exist_ok=True)
+    for t in range(store.vlmeta["n_channels"]):
+        nib.save(channel_as_nifti(store, t), os.path.join(images_folder, f"{case_id}_{t:04d}.nii.gz"))
+    if labels_folder is not None:
+        label = label_as_nifti(store)
+        if label is not None:
+            os.makedirs(labels_folder, exist_ok=True)
+            nib.save(label, os.path.join(labels_folder, f"{case_id}.nii.gz"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack per-channel NIfTI cases into one blosc2 container per subject (or export back)")
+    parser.add_argument("--mode", choices=["pack", "export"], default="pack")
+    parser.add_argument("--images_folder", required=True, help="imagesTr/imagesTs folder ({case}_000{t}.nii.gz)")
+    parser.add_argument("--labels_folder", default=None, help="labelsTr/labelsTs folder ({case}.nii.gz)")
+    parser.add_argument("--store_folder", required=True, help="Folder holding {case}.b2nd containers")
+    parser.add_argument("--chunks", type=int, nargs=3, default=None,
+                        help=f"Spatial chunk shape (default: half of patch size {PATCH_SIZE})")
+    parser.add_argument("--clevel", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.mode == "pack":
+        case_ids = sorted({f.split("_")[0] for f in os.listdir(args.images_folder) if f.endswith(".nii.gz")})
+        os.makedirs(args.store_folder, exist_ok=True)
+        unlabeled = []
+        for case_id in tqdm(case_ids, desc="Packing cases", unit="case"):
+            label_file = None
+            if args.labels_folder is not None:
+                label_file = os.path.join(args.labels_folder, f"{case_id}.nii.gz")
+                if not os.path.isfile(label_file):
+                    unlabeled.append(case_id)
+                    label_file = None
+            pack_case(find_case_channels(args.images_folder, case_id), label_file,
+                      os.path.join(args.store_folder, f"{case_id}{STORE_ENDING}"),
+                      chunks=args.chunks, clevel=args.clevel)
+
+        print(f"\n✅ Packed {len(case_ids)} cases into {args.store_folder}")
+        if unlabeled:
+            print(f"⚠️ No label found for {len(unlabeled)} cases (packed without label): {unlabeled}")
+    else:
+        stores = sorted(f for f in os.listdir(args.store_folder) if f.endswith(STORE_ENDING))
+        for f in tqdm(stores, desc="Exporting cases", unit="case"):
+            export_case_to_nifti(os.path.join(args.store_folder, f), args.images_folder, args.labels_folder)
+        print(f"\n✅ Exported {len(stores)} cases to {args.images_folder}")
@@ -0,0 +1,200 @@
+# predict_imagesTs.py
+
+import os
+import json
+import time
+import argparse
+from collections import deque
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+from threadpoolctl import threadpool_limits
+from nnunetv2.configuration import default_num_processes
+from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+from nnunetv2.inference.export_prediction import export_prediction_from_logits
+
+# ==== Defaults ====
+DATASET_NAME = "Dataset001_OpticRadiation"
+CONFIGURATION = "3d_fullres"
+PLANS = "nnUNetPlans"
+
+
+def load_test_cases(raw_dataset_dir):
+    """Return [(case_id, [channel files])] from the "test" list of dataset.json."""
+    with open(os.path.join(raw_dataset_dir, "dataset.json")) as f:
+        dataset_json = json.load(f)
+
+    cases = []
+    for files in dataset_json["test"]:
+        if isinstance(files, str):  # FA dataset (Dataset002) lists a single file per case
+            files = [files]
+        files = sorted(os.path.join(raw_dataset_dir, f) for f in files)
+        case_id = os.path.basename(files[0]).split("_")[0]
+        cases.append((case_id, files))
+    return sorted(cases)
+
+
+def model_folder_for(trainer, dataset_name=DATASET_NAME, plans=PLANS, configuration=CONFIGURATION):
+    return os.path.join(os.environ["nnUNet_results"], dataset_name, f"{trainer}__{plans}__{configuration}")
+
+
+def set_thread_budget(n_threads, n_prefetch, n_export):
+    """Split a CPU thread budget: one thread per loader/exporter process, the rest for torch in
+    the main process. predict_logits_from_preprocessed_data caps torch at nnU-Net's
+    default_num_processes (env nnUNet_def_n_proc), so the torch share is capped the same way."""
+    n_torch = max(1, min(n_threads - n_prefetch - n_export, default_num_processes))
+    torch.set_num_threads(n_torch)
+    return n_torch
+
+
+def build_predictor(model_folder, folds, checkpoint_name="checkpoint_final.pth", device="cuda",
+                    use_mirroring=True, tile_step_size=0.5):
+    """Load the network once; the parameters of all folds are kept and swapped in per prediction."""
+    device = torch.device(device)
+    predictor = nnUNetPredictor(
+        tile_step_size=tile_step_size,
+        use_gaussian=True,
+        use_mirroring=use_mirroring,
+        perform_everything_on_device=device.type == "cuda",
+        device=device,
+        verbose=False,
+        verbose_preprocessing=False,
+        allow_tqdm=False,
+    )
+    predictor.initialize_from_trained_model_folder(model_folder, use_folds=folds, checkpoint_name=checkpoint_name)
+    return predictor
+
+
+def preprocess_files(files, plans_manager, configuration_manager, dataset_json):
+    """Read + crop + normalize + resample one case exactly like nnUNetv2_predict does."""
+    preprocessor = configuration_manager.preprocessor_class(verbose=False)
+    data, _, properties = preprocessor.run_case(files, None, plans_manager, configuration_manager, dataset_json)
+    return data, properties
+
+
+def preprocess_case(predictor, files):
+    data, properties = preprocess_files(files, predictor.plans_manager, predictor.configuration_manager,
+                                        predictor.dataset_json)
+    data = torch.from_numpy(data).to(dtype=torch.float32, memory_format=torch.contiguous_format)
+    return data, properties
+
+
+# ==== Worker processes (loader / export pools) ====
+_worker_limits = None
+
+
+def _init_worker(n_threads):
+    """Each pool process gets its own torch and BLAS/OpenMP thread setting, so nothing it does
+    touches the thread count of the main process running the sliding window."""
+    global _worker_limits
+    torch.set_num_threads(n_threads)
+    _worker_limits = threadpool_limits(n_threads)
+
+
+def _load_worker(case_id, files, plans_manager, configuration_manager, dataset_json):
+    t0 = time.perf_counter()
+    data, properties = preprocess_files(files, plans_manager, configuration_manager, dataset_json)
+    return case_id, data, properties, time.perf_counter() - t0
+
+
+def _export_worker(logits, properties, configuration_manager, plans_manager, dataset_json, output_file_truncated,
+                   save_probabilities):
+    t0 = time.perf_counter()
+    export_prediction_from_logits(logits, properties, configuration_manager, plans_manager, dataset_json,
+                                  output_file_truncated, save_probabilities, num_threads_torch=1)
+    return time.perf_counter() - t0
+
+
+def predict_cases(predictor, cases, output_folder, n_prefetch=2, n_export=2, save_probabilities=False):
+    """Overlapped pipeline: a loader process pool prefetches upcoming cases, the main process runs
+    the sliding window, and an export process pool resamples + writes finished predictions.
+
+    Loaders and exporters are spawned processes with 1 torch / BLAS thread each (as in nnU-Net's own
+    predictor), so their nnU-Net/numpy thread settings cannot change the main process. The main
+    process is the only one running the network and keeps the torch thread count set by
+    set_thread_budget for the whole run.
+
+    Returns {stage: summed seconds} and prints cases/s per stage.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    stage_time = {"load+preprocess": 0.0, "predict": 0.0, "export": 0.0}
+    managers = (predictor.plans_manager, predictor.configuration_manager, predictor.dataset_json)
+    ctx = multiprocessing.get_context("spawn")
+
+    t_start = time.perf_counter()
+    with ProcessPoolExecutor(n_prefetch, mp_context=ctx, initializer=_init_worker, initargs=(1,)) as load_pool, \
+            ProcessPoolExecutor(n_export, mp_context=ctx, initializer=_init_worker, initargs=(1,)) as export_pool:
+        upcoming = iter(cases)
+        loading = deque(load_pool.submit(_load_worker, case_id, files, *managers)
+                        for _, (case_id, files) in zip(range(n_prefetch), upcoming))
+        exporting = deque()
+
+        while loading:
+            case_id, data, properties, t_load = loading.popleft().result()
+            next_case = next(upcoming, None)
+            if next_case is not None:
+                loading.append(load_pool.submit(_load_worker, *next_case, *managers))
+            stage_time["load+preprocess"] += t_load
+
+            data = torch.from_numpy(data).to(dtype=torch.float32, memory_format=torch.contiguous_format)
+            t0 = time.perf_counter()
+            logits = predictor.predict_logits_from_preprocessed_data(data).cpu()
+            t_predict = time.perf_counter() - t0
+            stage_time["predict"] += t_predict
+            print(f"🧠 {case_id}: predicted in {t_predict:.1f} s")
+
+            exporting.append(export_pool.submit(
+                _export_worker, logits, properties, predictor.configuration_manager, predictor.plans_manager,
+                predictor.dataset_json, os.path.join(output_folder, case_id), save_probabilities))
+            # don't let finished logits pile up in RAM if export is the bottleneck
+            while len(exporting) > 2 * n_export:
+                stage_time["export"] += exporting.popleft().result()
+
+        while exporting:
+            stage_time["export"] += exporting.popleft().result()
+    wall = time.perf_counter() - t_start
+
+    # busy time is summed over the processes of a stage: n / busy is the rate of one worker,
+    # workers * n / busy what the stage could sustain if it never waited on the others
+    workers = {"load+preprocess": n_prefetch, "predict": 1, "export": n_export}
+    n = len(cases)
+    print(f"\n📊 {n} cases in {wall:.1f} s -> {n / wall:.3f} cases/s overall")
+    for stage, t in stage_time.items():
+        rate = n / t if t > 0 else float('inf')
+        print(f"   {stage:<16} {t:8.1f} s busy   {rate:.3f} cases/s per worker   "
+              f"{workers[stage] * rate:.3f} cases/s with {workers[stage]} worker(s)")
+    return stage_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch-predict the dataset.json test list with overlapped load/predict/export")
+    parser.add_argument("--dataset", default=DATASET_NAME)
+    parser.add_argument("--trainer", default="nnUNetTrainer")
+    parser.add_argument("--plans", default=PLANS)
+    parser.add_argument("--configuration", default=CONFIGURATION)
+    parser.add_argument("--model_folder", default=None, help="Overrides the folder derived from $nnUNet_results")
+    parser.add_argument("--folds", type=int, nargs="+", default=[0, 1, 2, 3])
+    parser.add_argument("--checkpoint", default="checkpoint_final.pth")
+    parser.add_argument("--output_folder", required=True)
+    parser.add_argument("--device", default="cuda", choices=["cuda", "cpu"])
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="Total CPU thread budget")
+    parser.add_argument("--prefetch", type=int, default=2, help="Loader processes (cases decoded ahead)")
+    parser.add_argument("--export_workers", type=int, default=2, help="Export processes")
+    parser.add_argument("--no_mirroring", action="store_true")
+    parser.add_argument("--save_probabilities", action="store_true")
+    args = parser.parse_args()
+
+    n_torch = set_thread_budget(args.threads, args.prefetch, args.export_workers)
+    print(f"🔧 Threads: {n_torch} torch (max nnUNet_def_n_proc={default_num_processes}), "
+          f"{args.prefetch} loader, {args.export_workers} export processes with 1 thread each")
+
+    raw_dataset_dir = os.path.join(os.environ["nnUNet_raw"], args.dataset)
+    cases = load_test_cases(raw_dataset_dir)
+    print(f"📋 {len(cases)} test cases from {os.path.join(raw_dataset_dir, 'dataset.json')}")
+
+    model_folder = args.model_folder or model_folder_for(args.trainer, args.dataset, args.plans, args.configuration)
+    predictor = build_predictor(model_folder, args.folds, args.checkpoint, args.device, not args.no_mirroring)
+    print(f"✅ Loaded {model_folder} (folds {args.folds})")
+
+    predict_cases(predictor, cases, args.output_folder, args.prefetch, args.export_workers, args.save_probabilities)
+    print(f"\n🎉 Predictions written to {args.output_folder}")
@@ -4,8 +4,10 @@ import os
 import nibabel as nib
 from tqdm import tqdm
 import argparse
+from resample_peaks import HCP_SPACING, VECTOR_FRAME, VECTOR_FRAMES, resample_peaks_image
 
-def split_4d_nifti_one_patient(patient_folder, output_folder, patient_enum):
+def split_4d_nifti_one_patient(patient_folder, output_folder, patient_enum, target_spacing=None, reference=None,
+                               vector_frame=VECTOR_FRAME):
     os.makedirs(output_folder, exist_ok=True)
     input_path = os.path.join(patient_folder, 'peaks.nii.gz')
     patient_id = os.path.basename(patient_folder)
@@ -15,10 +17,13 @@ def split_4d_nifti_one_patient(patient_folder, output_folder, patient_enum):
         return False
     
     img = nib.load(input_path)
-    data = img.get_fdata()
-    if data.ndim != 4:
-        print(f"Image is not 4D but {data.ndim}D in {patient_id}")
+    if img.ndim != 4:
+        print(f"Image is not 4D but {img.ndim}D in {patient_id}")
         return False
+    if reference is not None or target_spacing is not None:
+        # non-HCP input: resample (and for voxel-frame peaks reorient) onto the HCP grid before splitting
+        img = resample_peaks_image(img, target_spacing or HCP_SPACING, reference, vector_frame=vector_frame)
+    data = img.get_fdata()
     
     for t in range(data.shape[3]):
         volume_3d = data[..., t]
@@ -33,6 +38,12 @@ if __name__ == "__main__":
     parser.add_argument("--parent_folder", required=True)
     parser.add_argument("--output_folder", required=True)
     parser.add_argument("--mapping_file", required=True)
+    parser.add_argument("--target_spacing", type=float, nargs=3, default=None,
+                        help="Resample peaks to this spacing first (e.g. 1.25 1.25 1.25 for non-HCP data)")
+    parser.add_argument("--reference", default=None,
+                        help="Resample peaks onto this image's grid (e.g. an HCP template), overrides --target_spacing")
+    parser.add_argument("--vector_frame", choices=VECTOR_FRAMES, default=VECTOR_FRAME,
+                        help="Frame of the peak vectors: world (MRtrix/TractSeg) or voxel axes (reoriented on resampling)")
     args = parser.parse_args()
 
     patient_folders = sorted([
@@ -41,9 +52,11 @@ if __name__ == "__main__":
         if os.path.isdir(os.path.join(args.parent_folder, f))
     ])
 
+    reference = nib.load(args.reference) if args.reference else None
     mapping_lines = []
     for i, patient_path in enumerate(tqdm(patient_folders, desc="Splitting peaks", unit="patient"), start=1):
-        success = split_4d_nifti_one_patient(patient_path, args.output_folder, i)
+        success = split_4d_nifti_one_patient(patient_path, args.output_folder, i, args.target_spacing,
+                                             reference, args.vector_frame)
         if success:
             original_id = os.path.basename(patient_path)
             mapping_lines.append(f"{i:03d} -> {original_id}\n")
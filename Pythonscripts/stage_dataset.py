@@ -0,0 +1,225 @@
+# stage_dataset.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import hashlib
+import argparse
+from filelock import FileLock, Timeout
+
+# ==== Defaults ====
+# Node-local and shared by all jobs of this user on the host. Don't use the per-job LSF $TMPDIR,
+# it is wiped when the job ends.
+STAGE_ROOT = os.environ.get("NNUNET_STAGE_DIR",
+                            os.path.join("/tmp", os.environ.get("USER", "nnunet"), "nnunet_stage"))
+MANIFEST = ".staged_manifest.json"
+USERS = ".users"
+FREE_MARGIN = 2 * 1024 ** 3  # keep 2 GB of scratch free for everyone else
+COPY_CHUNK = 16 * 1024 ** 2
+
+
+def log(msg):
+    # stdout only carries the resulting path, so `export nnUNet_preprocessed=$(python stage_dataset.py ...)` works
+    print(msg, file=sys.stderr)
+
+
+def scan_source(src_dir):
+    """{relative path: {size, mtime}} for every file of the shared dataset (one stat per file)."""
+    files = {}
+    for root, _, names in os.walk(src_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            files[os.path.relpath(path, src_dir)] = {"size": st.st_size, "mtime": st.st_mtime_ns}
+    return files
+
+
+def file_checksum(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def copy_with_checksum(src, dst):
+    """Copy src -> dst, hashing the source stream, then re-hash dst and compare."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        for block in iter(lambda: fin.read(COPY_CHUNK), b""):
+            h.update(block)
+            fout.write(block)
+    shutil.copystat(src, dst)
+    checksum = h.hexdigest()
+    if file_checksum(dst) != checksum:
+        raise OSError(f"Checksum mismatch after copying {src}")
+    return checksum
+
+
+def load_manifest(staged_dir):
+    path = os.path.join(staged_dir, MANIFEST)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_up_to_date(manifest, source_files):
+    if manifest is None:
+        return False
+    staged = {rel: {"size": v["size"], "mtime": v["mtime"]} for rel, v in manifest["files"].items()}
+    return staged == source_files
+
+
+def verify_checksums(staged_dir, manifest):
+    for rel, entry in manifest["files"].items():
+        if file_checksum(os.path.join(staged_dir, rel)) != entry["checksum"]:
+            log(f"⚠️ Checksum mismatch in staged copy: {rel}")
+            return False
+    return True
+
+
+def live_users(staged_dir):
+    """PIDs registered as using this copy that are still alive; stale markers are removed."""
+    users_dir = os.path.join(staged_dir, USERS)
+    alive = []
+    if not os.path.isdir(users_dir):
+        return alive
+    for marker in os.listdir(users_dir):
+        try:
+            pid = int(marker.rsplit("_", 1)[-1])
+        except ValueError:  # not a {host}_{pid} marker
+            continue
+        try:
+            os.kill(pid, 0)
+            alive.append(pid)
+        except ProcessLookupError:
+            os.remove(os.path.join(users_dir, marker))
+        except PermissionError:  # alive, owned by someone else
+            alive.append(pid)
+    return alive
+
+
+def register_user(staged_dir, owner_pid):
+    users_dir = os.path.join(staged_dir, USERS)
+    os.makedirs(users_dir, exist_ok=True)
+    open(os.path.join(users_dir, f"{socket.gethostname()}_{owner_pid}"), "w").close()
+    # LRU timestamp
+    os.utime(os.path.join(staged_dir, MANIFEST))
+
+
+def evict_lru(stage_root, needed_bytes, keep, lock_dir):
+    """Delete least recently used staged datasets (not in use, not locked) until needed_bytes fit."""
+    datasets_root = os.path.join(stage_root, "nnunet_preprocessed")
+    candidates = []
+    for name in os.listdir(datasets_root):
+        path = os.path.join(datasets_root, name)
+        manifest_path = os.path.join(path, MANIFEST)
+        if name == keep or not os.path.isfile(manifest_path):
+            continue
+        candidates.append((os.path.getmtime(manifest_path), name, path))
+
+    for _, name, path in sorted(candidates):
+        if shutil.disk_usage(stage_root).free >= needed_bytes + FREE_MARGIN:
+            break
+        lock = FileLock(os.path.join(lock_dir, f"{name}.lock"))
+        try:
+            lock.acquire(timeout=0)
+        except Timeout:
+            continue
+        try:
+            if live_users(path):
+                continue
+            log(f"🧹 Evicting least recently used staged dataset {name}")
+            shutil.rmtree(path)
+        finally:
+            lock.release()
+    return shutil.disk_usage(stage_root).free >= needed_bytes + FREE_MARGIN
+
+
+def stage_dataset(preprocessed_root, dataset_name, stage_root=STAGE_ROOT, owner_pid=None,
+                  lock_timeout=3600, check_checksums=True):
+    """Make {preprocessed_root}/{dataset_name} available on node-local scratch.
+
+    An existing copy is reused only if it matches the source file list (size/mtime) and, unless
+    check_checksums is off, every local file re-hashes to the checksum recorded at copy time.
+
+    Returns the nnUNet_preprocessed root to use: the staged one, or preprocessed_root if staging
+    is not possible (no space, lock timeout, I/O error, copy in use by jobs on an older version).
+    """
+    owner_pid = owner_pid or os.getppid()
+    src_dir = os.path.join(preprocessed_root, dataset_name)
+    staged_root = os.path.join(stage_root, "nnunet_preprocessed")
+    staged_dir = os.path.join(staged_root, dataset_name)
+    lock_dir = os.path.join(stage_root, "locks")
+
+    try:
+        os.makedirs(staged_root, exist_ok=True)
+        os.makedirs(lock_dir, exist_ok=True)
+        with FileLock(os.path.join(lock_dir, f"{dataset_name}.lock"), timeout=lock_timeout):
+            source_files = scan_source(src_dir)
+            manifest = load_manifest(staged_dir)
+
+            if is_up_to_date(manifest, source_files) and (not check_checksums or verify_checksums(staged_dir, manifest)):
+                register_user(staged_dir, owner_pid)
+                log(f"✅ Using staged copy {staged_dir}")
+                return staged_root
+
+            if os.path.isdir(staged_dir):
+                if live_users(staged_dir):
+                    log(f"⚠️ Staged copy of {dataset_name} is outdated but still in use, reading from shared path")
+                    return preprocessed_root
+                shutil.rmtree(staged_dir)
+
+            needed = sum(v["size"] for v in source_files.values())
+            with FileLock(os.path.join(lock_dir, "evict.lock"), timeout=lock_timeout):
+                if not evict_lru(stage_root, needed, dataset_name, lock_dir):
+                    log(f"⚠️ Not enough scratch space for {needed / 1024 ** 3:.1f} GB, reading from shared path")
+                    return preprocessed_root
+
+            log(f"⏳ Staging {src_dir} -> {staged_dir} ({len(source_files)} files, {needed / 1024 ** 3:.1f} GB)")
+            t0 = time.time()
+            partial_dir = staged_dir + ".partial"
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            files = {}
+            try:
+                for rel, entry in source_files.items():
+                    dst = os.path.join(partial_dir, rel)
+                    os.makedirs(os.path.dirname(dst), exist_ok=True)
+                    files[rel] = dict(entry, checksum=copy_with_checksum(os.path.join(src_dir, rel), dst))
+                with open(os.path.join(partial_dir, MANIFEST), "w") as f:
+                    json.dump({"source": src_dir, "files": files}, f)
+                os.rename(partial_dir, staged_dir)
+            except OSError:
+                # a half-written copy has no manifest, so evict_lru would never reclaim it
+                shutil.rmtree(partial_dir, ignore_errors=True)
+                raise
+
+            register_user(staged_dir, owner_pid)
+            log(f"✅ Staged in {time.time() - t0:.0f} s")
+            return staged_root
+    except (OSError, Timeout) as e:
+        log(f"⚠️ Staging failed ({e}), reading from shared path")
+        return preprocessed_root
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stage an nnU-Net preprocessed dataset on node-local scratch and print the nnUNet_preprocessed root to use")
+    parser.add_argument("--preprocessed_root", default=os.environ.get("nnUNet_preprocessed"))
+    parser.add_argument("--dataset", default="Dataset001_OpticRadiation")
+    parser.add_argument("--stage_root", default=STAGE_ROOT)
+    parser.add_argument("--owner_pid", type=int, default=None,
+                        help="PID that keeps the copy in use (pass $$ from the job script; default: parent PID)")
+    parser.add_argument("--lock_timeout", type=float, default=3600)
+    parser.add_argument("--skip_checksums", action="store_true",
+                        help="Reuse an existing staged copy without re-hashing it (size/mtime check only)")
+    args = parser.parse_args()
+
+    if args.preprocessed_root is None:
+        parser.error("--preprocessed_root is required when $nnUNet_preprocessed is not set")
+
+    print(stage_dataset(args.preprocessed_root, args.dataset, args.stage_root, args.owner_pid,
+                        args.lock_timeout, not args.skip_checksums))
@@ -25,7 +25,9 @@ TRAINERS=(
 )
 
 DATASET=001
+DATASET_NAME=Dataset001_OpticRadiation
 CONFIG=3d_fullres
+REPO_DIR=$(cd "$(dirname "$0")" && pwd)
 
 # CHANGE: Only fold 2 for testing
 for TR in "${TRAINERS[@]}"; do
@@ -47,6 +49,11 @@ export nnUNet_raw=/omics/groups/OE0441/E132-Projekte/Projects/2025_Peretzke_Elsh
 export nnUNet_preprocessed=/omics/groups/OE0441/E132-Projekte/Projects/2025_Peretzke_Elsherif_nnTractSeg/HCP-nnUnetSetup/nnunet_preprocessed
 export nnUNet_results=/omics/groups/OE0441/E132-Projekte/Projects/2025_Peretzke_Elsherif_nnTractSeg/HCP-nnUnetSetup/nnunet_results
 
+# Stage the preprocessed dataset on node-local scratch (shared by all jobs on this host).
+# Falls back to the GPFS path if staging is not possible.
+STAGED=\$(python ${REPO_DIR}/Pythonscripts/stage_dataset.py --dataset ${DATASET_NAME} --owner_pid \$\$) && export nnUNet_preprocessed=\$STAGED
+echo "nnUNet_preprocessed: \$nnUNet_preprocessed"
+
 echo "Running trainer: ${TR}  Fold: ${FOLD}"
 
 nnUNetv2_train $DATASET $CONFIG $FOLD -tr $TR --c